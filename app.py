@@ -1,22 +1,33 @@
+import collections
+import hashlib
+import itertools
+import threading
+import time
+
 import streamlit as st
 from google import genai
+
+# --- 설정 ---
+MODEL = 'gemini-2.5-flash'
+DEFAULT_PROMPT = "저는 Streamlit 앱 배포 오류를 성공적으로 해결했습니다. 이에 대해 축하하는 매우 신나는 문장 하나만 작성해 주세요."
+MAX_RETRIES = 3
+MAX_RETRY_WAIT = 60  # 초
+RATE_LIMIT_REQUESTS = 15  # 무료 등급 분당 요청 수
+RATE_LIMIT_WINDOW = 60  # 초
+RESPONSE_CACHE_TTL = 3600  # 초
+RESPONSE_CACHE_MAX_ENTRIES = 100
+
+
 # google.genai.errors 경로가 최신 버전에서 표준입니다.
+# 401/403/429 등은 모두 APIError(ClientError/ServerError)로 전달되며, 상태 코드는 e.code로 구분합니다.
 try:
-    from google.genai.errors import (
-        PermissionDenied,
-        ResourceExhausted,
-        Unauthenticated,
-        APIError
-    )
+    from google.genai.errors import APIError
 except ImportError as e:
     # 캐시 지우고 재실행했음에도 이 오류가 계속되면,
     # 이는 Streamlit Cloud 환경 자체의 문제입니다.
     st.error(f"라이브러리 임포트 오류가 발생했습니다: {e}")
     st.warning("⚠️ **심각한 환경 문제입니다.** Streamlit Cloud에서 캐시를 지웠는데도 이 오류가 계속된다면, GitHub에서 프로젝트를 **삭제 후 재배포**를 시도하거나, `google-genai`의 버전을 명시한 `requirements.txt`가 올바른지 다시 확인해야 합니다.")
     st.stop()
-except Exception as e:
-    st.error(f"예상치 못한 초기화 오류: {e}")
-    st.stop()
 
 
 # --- UI 설정 ---
@@ -24,10 +35,132 @@ st.set_page_config(page_title="Gemini API 오류 진단기", layout="centered")
 st.title("Gemini API 오류 진단 및 수정기 🛠️")
 st.markdown("Streamlit 환경에서 Gemini API 연결 상태를 확인하고, 발생 가능한 오류를 진단합니다.")
 
+
+@st.cache_resource
+def get_gemini_client(api_key):
+    # Streamlit은 상호작용마다 스크립트 전체를 재실행하므로,
+    # 클라이언트(및 HTTP 연결 풀)는 프로세스당 한 번만 생성해 재사용합니다.
+    return genai.Client(api_key=api_key)
+
+
+def _quota_error_info(error):
+    # 429 오류 본문에서 (재시도 대기 초, 일일 할당량 소진 여부)를 추출합니다.
+    body = getattr(error, "details", None) or {}
+    if isinstance(body, dict):
+        body = body.get("error", body)
+    details = body.get("details", []) if isinstance(body, dict) else []
+
+    retry_delay = None
+    daily_quota = False
+    for detail in details:
+        type_url = detail.get("@type", "")
+        if type_url.endswith("RetryInfo"):
+            try:
+                retry_delay = int(float(detail.get("retryDelay", "").rstrip("s")))
+            except ValueError:
+                pass
+        elif type_url.endswith("QuotaFailure"):
+            for violation in detail.get("violations", []):
+                if "PerDay" in violation.get("quotaId", ""):
+                    daily_quota = True
+    return retry_delay, daily_quota
+
+
+@st.cache_resource
+def _rate_limiter():
+    # 재실행과 세션 사이에 공유되는 최근 요청 시각 기록과 잠금입니다.
+    return collections.deque(maxlen=RATE_LIMIT_REQUESTS), threading.Lock()
+
+
+def _wait_for_rate_limit():
+    # 429를 받기 전에 클라이언트 측에서 분당 요청 수를 제한합니다.
+    # 잠금 안에서는 대기 시간 계산과 슬롯 예약만 하고, 실제 대기는 잠금을 놓은 뒤 수행해
+    # 다른 세션이 막히지 않도록 합니다.
+    bucket, lock = _rate_limiter()
+    with lock:
+        now = time.monotonic()
+        while bucket and now - bucket[0] > RATE_LIMIT_WINDOW:
+            bucket.popleft()
+        if len(bucket) == RATE_LIMIT_REQUESTS:
+            slot = max(now, bucket[0] + RATE_LIMIT_WINDOW)
+        else:
+            slot = now
+        bucket.append(slot)
+
+    wait = slot - now
+    if wait > 0:
+        st.toast(f"⏳ 분당 요청 한도({RATE_LIMIT_REQUESTS}회)에 도달해 {wait:.0f}초 대기합니다.")
+        time.sleep(wait)
+
+
+def generate_stream_with_retry(client, model, prompt):
+    # 응답을 스트리밍으로 받아 첫 청크부터 바로 화면에 표시합니다.
+    # 분당 요청 제한(429)은 서버가 알려준 RetryInfo.retryDelay만큼 기다린 뒤 재시도하고,
+    # 값이 없을 때만 지수 백오프를 사용합니다. 일일 할당량 소진은 재시도하지 않습니다.
+    # 재시도는 아직 아무 청크도 받지 못한 경우에만 수행합니다.
+    for attempt in range(MAX_RETRIES + 1):
+        _wait_for_rate_limit()
+        try:
+            stream = iter(client.models.generate_content_stream(model=model, contents=prompt))
+            first_chunk = next(stream, None)
+        except APIError as e:
+            if e.code != 429:
+                raise
+            retry_delay, daily_quota = _quota_error_info(e)
+            if daily_quota or attempt == MAX_RETRIES:
+                raise
+            wait = min(retry_delay + 1 if retry_delay is not None else 2 ** attempt, MAX_RETRY_WAIT)
+            st.toast(f"⏳ 요청 속도 제한(429)으로 {wait}초 후 재시도합니다. ({attempt + 1}/{MAX_RETRIES})")
+            time.sleep(wait)
+            continue
+
+        if first_chunk is not None and first_chunk.text:
+            yield first_chunk.text
+        for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+        return
+
+
+@st.cache_resource
+def _response_cache():
+    # 같은 (API 키, 모델, 프롬프트) 조합은 1시간 동안 캐시된 응답을 돌려주어 할당량을 아낍니다.
+    # 스트리밍 응답은 st.cache_data로 캐시할 수 없으므로, 완성된 텍스트를 직접 보관합니다.
+    return {}, threading.Lock()
+
+
+def _response_cache_key(api_key, model, prompt):
+    # 키 원문 대신 해시를 사용해, 키가 바뀌면 이전 응답이 재사용되지 않도록 합니다.
+    return hashlib.sha256(api_key.encode()).hexdigest(), model, prompt
+
+
+def _get_cached_response(key):
+    cache, lock = _response_cache()
+    with lock:
+        entry = cache.get(key)
+    if entry and time.monotonic() - entry[0] < RESPONSE_CACHE_TTL:
+        return entry
+    return None
+
+
+def _store_cached_response(key, text):
+    cache, lock = _response_cache()
+    with lock:
+        now = time.monotonic()
+        for expired in [k for k, (saved_at, _) in cache.items() if now - saved_at >= RESPONSE_CACHE_TTL]:
+            del cache[expired]
+        cache.pop(key, None)
+        while len(cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+            # dict는 삽입 순서를 유지하므로 가장 오래된 항목부터 제거합니다.
+            del cache[next(iter(cache))]
+        cache[key] = (now, text)
+
+
 # --- API 키 로드 ---
 api_key = None
 try:
     # st.secrets에서 GEMINI_API_KEY를 안전하게 불러옵니다.
+    # 매 실행마다 읽어야 Secrets에서 키를 고친 뒤 재부팅 없이 바로 반영됩니다.
     api_key = st.secrets["GEMINI_API_KEY"]
 except KeyError:
     st.error("🚨 환경 변수 오류: Streamlit Secrets에서 'GEMINI_API_KEY'를 찾을 수 없습니다.")
@@ -39,7 +172,7 @@ client = None
 if api_key:
     try:
         # 불러온 API 키로 Gemini 클라이언트를 초기화합니다.
-        client = genai.Client(api_key=api_key)
+        client = get_gemini_client(api_key)
         st.sidebar.success("✅ Gemini 클라이언트 초기화 완료.")
         st.sidebar.text("이제 AI 응답 테스트를 할 수 있습니다.")
     except Exception as e:
@@ -48,10 +181,10 @@ if api_key:
 
 # --- API 호출 및 오류 진단 ---
 if client:
-    model = 'gemini-2.5-flash'
+    model = MODEL
     prompt = st.text_area(
         "테스트 프롬프트 (수정 가능)",
-        "저는 Streamlit 앱 배포 오류를 성공적으로 해결했습니다. 이에 대해 축하하는 매우 신나는 문장 하나만 작성해 주세요.",
+        DEFAULT_PROMPT,
         height=100
     )
     
@@ -59,34 +192,44 @@ if client:
 
     if st.button("AI 응답 생성 및 오류 진단 테스트 시작 🚀"):
         st.subheader("진단 결과:")
-        with st.spinner("응답을 생성하며 API 상태를 확인하는 중입니다. 문제가 있다면 오류 코드가 표시됩니다..."):
-            try:
-                # API 호출
-                response = client.models.generate_content(
-                    model=model,
-                    contents=prompt
-                )
+        try:
+            cache_key = _response_cache_key(api_key, model, prompt)
+            cached = _get_cached_response(cache_key)
+            if cached:
+                minutes_ago = int((time.monotonic() - cached[0]) // 60)
+                st.info(f"💾 {minutes_ago}분 전에 같은 키·모델·프롬프트로 받은 캐시된 응답입니다. 이번에는 API를 호출하지 않았으므로 현재 키 상태는 확인되지 않았습니다. 실시간 진단이 필요하면 프롬프트를 수정해 다시 시도해주세요.")
+                st.subheader("Gemini 응답:")
+                st.markdown(cached[1])
+            else:
+                # API 호출 (스트리밍): 첫 청크가 도착할 때까지(재시도 대기 포함) 스피너를 표시합니다.
+                with st.spinner("응답을 생성하며 API 상태를 확인하는 중입니다. 문제가 있다면 오류 코드가 표시됩니다..."):
+                    chunks = generate_stream_with_retry(client, model, prompt)
+                    first_chunk = next(chunks, "")
+                st.subheader("Gemini 응답:")
+                response_text = st.write_stream(itertools.chain([first_chunk], chunks))
+                _store_cached_response(cache_key, response_text)
 
                 st.success("🎉 API 호출 성공: 모든 설정이 올바릅니다.")
-                st.subheader("Gemini 응답:")
-                st.info(response.text)
 
-            except (PermissionDenied, Unauthenticated) as e:
+        except APIError as e:
+            if e.code in (401, 403):
                 st.error("🛑 권한/인증 오류 (HTTP 401/403): API 키 문제")
                 st.warning("1. **API 키가 만료되거나 취소되지 않았는지** 확인해주세요.")
                 st.warning("2. **Google Cloud Console에서 해당 프로젝트의 결제(Billing)가 활성화**되어 있는지 확인해주세요.")
-                st.text(f"상세 오류: {e}")
-
-            except ResourceExhausted as e:
+            elif e.code == 429:
+                retry_delay, daily_quota = _quota_error_info(e)
                 st.error("📈 할당량 초과 오류 (HTTP 429): 사용 제한 초과")
-                st.warning("👉 **해결책**: API 사용량이 너무 많습니다. 잠시 후 다시 시도하거나, 할당량을 늘려주세요.")
-                st.text(f"상세 오류: {e}")
-
-            except APIError as e:
+                if daily_quota:
+                    st.warning("👉 **해결책**: 일일 할당량을 모두 사용했습니다. 할당량이 초기화된 뒤 다시 시도하거나, 할당량을 늘려주세요.")
+                elif retry_delay is not None:
+                    st.warning(f"👉 **해결책**: 요청 속도 제한에 걸렸습니다. 약 {retry_delay}초 후 다시 시도해주세요.")
+                else:
+                    st.warning("👉 **해결책**: API 사용량이 너무 많습니다. 잠시 후 다시 시도하거나, 할당량을 늘려주세요.")
+            else:
                 st.error(f"⚠️ API 호출 중 일반 오류가 발생했습니다. (Gemini 서버 문제 또는 요청 형식 오류)")
                 st.warning("👉 **해결책**: API 키에 IP 주소나 HTTP 참조 등의 **제한(Restrictions)**이 걸려 있다면 임시적으로 제거해 보세요.")
-                st.text(f"상세 오류: {e}")
+            st.text(f"상세 오류: {e}")
 
-            except Exception as e:
-                st.exception(f"❌ 예상치 못한 오류가 발생했습니다:")
-                st.text(f"Python 실행 오류: {e}")
+        except Exception as e:
+            st.exception(f"❌ 예상치 못한 오류가 발생했습니다:")
+            st.text(f"Python 실행 오류: {e}")